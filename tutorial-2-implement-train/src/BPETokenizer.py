@@ -13,7 +13,12 @@ class BPETokenizer:
         self.bpe_merges = {}
 
     def train(
-        self, text: str, vocab_size: int, allowed_special: set[str] = None
+        self,
+        text: str,
+        vocab_size: int,
+        allowed_special: set[str] = None,
+        num_workers: int = 1,
+        verbose: bool = False,
     ) -> None:
         """
         Train the BPE tokenizer on the provided text.
@@ -22,6 +27,10 @@ class BPETokenizer:
             text (str): The training text.
             vocab_size (int): The desired vocabulary size.
             allowed_special (set[str], optional): Special tokens to include in the vocabulary.
+            num_workers (int, optional): Number of processes used to pre-tokenize and
+                count the text. The text is split on paragraph breaks, so this only
+                helps for large texts. The merge loop itself always runs in this process.
+            verbose (bool, optional): Print each pair as it is merged.
 
         Implementation note:
         This implementation satisfies three test cases in the tutorial:
@@ -24,7 +24,7 @@ class TestBPETokenizer:
         text = "hello"
         tokenizer.train(text, vocab_size=10)  # vocab_size is larger than unique chars
 
-        unique_chars = sorted(list(set(text)))
+        unique_chars = sorted(set(text))
         expected_vocab = {i: ch for i, ch in enumerate(unique_chars)}
         expected_inverse_vocab = {ch: i for i, ch in enumerate(unique_chars)}
 
@@ -39,7 +39,7 @@ class TestBPETokenizer:
         tokenizer = BPETokenizer()
         text = "ababab"  # Most frequent pair is ('a', 'b')
 
-        initial_chars = sorted(list(set(text)))
+        initial_chars = sorted(set(text))
         vocab_size = len(initial_chars) + 1  # Allows for exactly one merge
 
         tokenizer.train(text, vocab_size)
@@ -72,7 +72,7 @@ class TestBPETokenizer:
         tokenizer = BPETokenizer()
         text = "abcde"
 
-        initial_chars = sorted(list(set(text)))
+        initial_chars = sorted(set(text))
         vocab_size = len(initial_chars) + 5  # Plenty of room, but no pairs to merge
 
         tokenizer.train(text, vocab_size)
@@ -185,3 +185,45 @@ class TestBPETokenizer:
             assert (
                 token in tokenizer.inverse_vocab
             ), f"Special token {token} should be in vocab"
+
+    def test_train_matches_find_freq_pair_loop(self):
+        """Test that train merges the same pairs, in the same order, as repeatedly
+        calling find_freq_pair and replace_pair, including on tied counts."""
+        tokenizer = BPETokenizer()
+        text = "ccccacaca"  # A single word with several tied pairs
+        vocab_size = 8
+        tokenizer.train(text, vocab_size)
+
+        token_ids = [tokenizer.inverse_vocab[ch] for ch in text]
+        expected_merges = {}
+        next_id = len(set(text))
+        while next_id < vocab_size:
+            pair = tokenizer.find_freq_pair(token_ids)
+            if pair is None:
+                break
+            expected_merges[pair] = next_id
+            token_ids = tokenizer.replace_pair(token_ids, pair, next_id)
+            next_id += 1
+
+        assert tokenizer.bpe_merges == expected_merges, "Ties should go to the pair that occurs first"
+
+    def test_train_does_not_merge_across_words(self):
+        """Test that merges stay within pre-tokenized, word-like chunks."""
+        tokenizer = BPETokenizer()
+        text = "a a a a"  # Chunks: "a", " a", " a", " a"
+        tokenizer.train(text, vocab_size=5)
+
+        assert " a" in tokenizer.inverse_vocab, "Space should merge with the following word"
+        assert "a " not in tokenizer.inverse_vocab, "Merges should not cross word boundaries"
+
+    def test_train_with_multiple_workers(self):
+        """Test that counting the text in several processes learns the same merges."""
+        text = "hello world\n\nhello there\n\nworld peace\n\n" * 10
+
+        tokenizer = BPETokenizer()
+        tokenizer.train(text, vocab_size=20)
+        parallel_tokenizer = BPETokenizer()
+        parallel_tokenizer.train(text, vocab_size=20, num_workers=2)
+
+        assert parallel_tokenizer.vocab == tokenizer.vocab
+        assert parallel_tokenizer.bpe_merges == tokenizer.bpe_merges
@@ -1,4 +1,53 @@
-from collections import Counter, deque
+import heapq
+import multiprocessing
+import re
+from collections import Counter, defaultdict
+from itertools import pairwise
+
+# Pre-tokenization pattern, adapted from GPT-4's to the standard `re` module:
+# contractions, words with an optional leading space or punctuation, numbers
+# of up to three digits, punctuation runs and whitespace.
+_PRETOKENIZE_RE = re.compile(
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)"
+    r"|(?:[^\r\n\w]|_)?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?(?:[^\s\w]|_)+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+(?!\S)"
+    r"|\s+"
+)
+
+
+def _count_chunks(text: str) -> Counter:
+    """Pre-tokenize the text and count how often each chunk occurs."""
+    return Counter(_PRETOKENIZE_RE.findall(text))
+
+
+def _split_into_shards(text: str, num_shards: int) -> list[str]:
+    """
+    Split the text into roughly equal shards at paragraph breaks ("\n\n").
+
+    Each cut is placed right after the last newline of a whitespace run, where
+    `_PRETOKENIZE_RE` always ends a chunk, so counting the shards separately
+    gives exactly the same chunks as counting the whole text.
+    """
+    shards = []
+    start = 0
+    for k in range(1, num_shards):
+        paragraph_break = text.find("\n\n", max(start, k * len(text) // num_shards))
+        if paragraph_break == -1:
+            break
+        end = paragraph_break + 2
+        while end < len(text) and text[end].isspace():
+            end += 1
+        if end == len(text):
+            break
+        cut = max(text.rfind("\n", paragraph_break, end), text.rfind("\r", paragraph_break, end)) + 1
+        shards.append(text[start:cut])
+        start = cut
+    shards.append(text[start:])
+    return shards
+
 
 class BPETokenizer:
     """A simple implementation of Byte Pair Encoding (BPE) tokenizer."""
@@ -12,7 +61,9 @@ class BPETokenizer:
         # Dictionary of BPE merges: {(token1, token2): merged_token_id}
         self.bpe_merges = {}
         
-    def encode(self, text: str, allowed_specials: set[str] = None) -> list[int]:
+    def encode(
+        self, text: str, allowed_specials: set[str] = None, verbose: bool = False
+    ) -> list[int]:
         """
         Encode text into a sequence of token IDs using the trained BPE merges.
         
@@ -28,6 +79,7 @@ class BPETokenizer:
                 but appears in the text, all characters will be treated as regular text.
                 For example, if "<|endoftext|>" is in allowed_specials and text, it will
                 be encoded as a single token.
+            verbose (bool, optional): Print the intermediate segments while encoding.
             
         Returns:
             list[int]: A sequence of token IDs representing the encoded text. For example,
@@ -46,6 +98,48 @@ class BPETokenizer:
         """
         pass
     
+    def encode_batch(
+        self,
+        texts: list[str],
+        allowed_specials: set[str] = None,
+        num_workers: int = 1,
+        chunk_size: int = 100,
+    ) -> list[list[int]]:
+        """
+        Encode several texts, optionally spread over worker processes.
+
+        Args:
+            texts (list[str]): The texts to encode.
+            allowed_specials (set[str], optional): Special tokens allowed in the texts,
+                as in `encode`.
+            num_workers (int, optional): Number of processes to encode with. Each worker
+                gets its own copy of the tokenizer, so this only pays off for many or
+                long texts.
+            chunk_size (int, optional): Number of texts sent to a worker at a time.
+
+        Returns:
+            list[list[int]]: The token IDs of each text, in the same order as `texts`.
+
+        Raises:
+            ValueError: For the same reasons as `encode`
+        """
+        pass
+
+    def set_merge_cache_size(self, size: int) -> None:
+        """
+        Set how many encoded chunks `encode` keeps in its cache.
+
+        The least recently used chunks are evicted first once the cache is
+        full. A size of 0 disables the cache.
+
+        Args:
+            size (int): Maximum number of cached chunks.
+
+        Raises:
+            ValueError: If size is negative
+        """
+        pass
+
     def decode(self, token_ids: list[int]) -> str:
         """
         Decode a sequence of token IDs back into text.
@@ -76,11 +170,19 @@ class BPETokenizer:
         2. Find any adjacent pairs that have a merge rule
         3. Apply the merge by replacing the pair with its merged token ID
         4. Repeat until no more merges are possible
+
+        Merges are applied in the order they were learned (smallest merged token
+        ID first), which is how `train` segmented its own text.
         """
         pass
 
     def train(
-        self, text: str, vocab_size: int, allowed_special: set[str] = None
+        self,
+        text: str,
+        vocab_size: int,
+        allowed_special: set[str] = None,
+        num_workers: int = 1,
+        verbose: bool = False,
     ) -> None:
         """
         Train the BPE tokenizer on the provided text.
@@ -89,6 +191,10 @@ class BPETokenizer:
             text (str): The training text.
             vocab_size (int): The desired vocabulary size.
             allowed_special (set[str], optional): Special tokens to include in the vocabulary.
+            num_workers (int, optional): Number of processes used to pre-tokenize and
+                count the text. The text is split on paragraph breaks, so this only
+                helps for large texts. The merge loop itself always runs in this process.
+            verbose (bool, optional): Print each pair as it is merged.
 
         Implementation note:
         This implementation satisfies three test cases in the tutorial:
@@ -98,33 +204,138 @@ class BPETokenizer:
 
         See the test file and tutorial for detailed expectations of each component.
         """
+        # Split the text into word-like chunks first; merges never cross a
+        # chunk boundary, so each distinct chunk only needs to be stored once
+        # together with how often it occurs.
+        shards = _split_into_shards(text, num_workers) if num_workers > 1 else [text]
+        if len(shards) > 1:
+            with multiprocessing.Pool(min(num_workers, len(shards))) as pool:
+                chunk_counts = Counter()
+                for partial_counts in pool.map(_count_chunks, shards):
+                    chunk_counts.update(partial_counts)
+        else:
+            chunk_counts = _count_chunks(text)
+
         # build the initial vocab without BPE
         # pass `test_train_builds_initial_vocab`
-        unique_char = sorted(list(set(text)))
-        self.vocab = {i: ch for i, ch in enumerate(unique_char)}
+        # The distinct chunks contain every character of the text, and are
+        # much shorter in total than the text itself
+        unique_char = sorted(set().union(*chunk_counts))
+        self.vocab = dict(enumerate(unique_char))
         self.inverse_vocab = {ch: i for i, ch in self.vocab.items()}
+        # Merges from an earlier call refer to IDs of the old vocab
+        self.bpe_merges = {}
 
         # pass `test_train_learns_merges_and_respects_vocab_size`
         # iterate vocab and build merges using BPE
-        token_ids = [self.inverse_vocab[ch] for ch in text]
-        while len(self.vocab) < vocab_size:
-            pair = self.find_freq_pair(token_ids)
-            print(pair)
-            if pair is None:
-                break
+        # Lay the distinct chunks out one after another as doubly-linked lists
+        # over positions, so a merge only touches the neighbours of each merged
+        # position instead of rebuilding the whole sequence. -1 means "no
+        # neighbour", which also separates the chunks.
+        token_ids, freqs, prev_pos, next_pos = [], [], [], []
+        for chunk, freq in chunk_counts.items():
+            start, end = len(token_ids), len(token_ids) + len(chunk)
+            token_ids.extend(self.inverse_vocab[ch] for ch in chunk)
+            freqs.extend([freq] * len(chunk))
+            prev_pos.extend(range(start - 1, end - 1))
+            next_pos.extend(range(start + 1, end + 1))
+            prev_pos[start] = -1
+            next_pos[-1] = -1
+
+        # Count every adjacent pair once (weighted by the chunk frequency),
+        # and remember where each pair occurs
+        pair_counts = Counter()
+        pair_positions = defaultdict(set)
+        for i, j in enumerate(next_pos):
+            if j != -1:
+                pair = (token_ids[i], token_ids[j])
+                pair_counts[pair] += freqs[i]
+                pair_positions[pair].add(i)
+
+        # Max-heap of (-count, first_position, pair). Counts and positions change
+        # as we merge, so instead of updating entries in place we push a new one
+        # and skip the stale ones (whose count or first position no longer match)
+        # when popped. Like `find_freq_pair`, ties go to the pair whose current
+        # first occurrence comes earliest.
+        heap = [(-count, min(pair_positions[pair]), pair) for pair, count in pair_counts.items()]
+        heapq.heapify(heap)
+
+        # Pairs whose count changed during the current merge. They are pushed
+        # once with their final count after the merge, rather than once per
+        # update, which keeps the number of stale heap entries down.
+        changed_pairs = set()
+
+        def update_pair(pair, position, delta):
+            pair_counts[pair] += delta
+            if delta > 0:
+                pair_positions[pair].add(position)
             else:
-                pair_id = max(self.vocab) + 1
-                self.bpe_merges[pair] = pair_id
+                pair_positions[pair].discard(position)
+            changed_pairs.add(pair)
+
+        # Same stopping rule as `find_freq_pair`: only merge repeated pairs.
+        # Every live count has an entry in the heap, so once the top entry is
+        # below 2 no pair can be merged anymore and we can stop right away.
+        while len(self.vocab) < vocab_size and heap and -heap[0][0] >= 2:
+            neg_count, first, pair = heapq.heappop(heap)
+            if pair_counts[pair] != -neg_count or min(pair_positions[pair]) != first:
+                continue
+            if verbose:
+                print(pair)
+
+            # IDs are dense (0 .. len(vocab) - 1), so the next free one is the size
+            pair_id = len(self.vocab)
+            self.bpe_merges[pair] = pair_id
+
+            self.vocab[pair_id] = self.vocab[pair[0]] + self.vocab[pair[1]]
+            self.inverse_vocab[self.vocab[pair_id]] = pair_id
+
+            # Merge left to right, like `replace_pair` does
+            for i in sorted(pair_positions.pop(pair)):
+                j = next_pos[i]
+                # Skip positions already consumed by an overlapping merge (e.g. "aaa")
+                if token_ids[i] != pair[0] or j == -1 or token_ids[j] != pair[1]:
+                    continue
+                before, after = prev_pos[i], next_pos[j]
+                freq = freqs[i]
+
+                # Remove the pairs the merged tokens formed with their neighbours
+                if before != -1:
+                    update_pair((token_ids[before], pair[0]), before, -freq)
+                if after != -1:
+                    update_pair((pair[1], token_ids[after]), j, -freq)
 
-                self.vocab[pair_id] = self.vocab[pair[0]] + self.vocab[pair[1]]
-                self.inverse_vocab[self.vocab[pair_id]] = pair_id
-                token_ids = self.replace_pair(token_ids, pair, pair_id)
+                # Splice out the right token and write the merged one in place
+                token_ids[i] = pair_id
+                token_ids[j] = -1
+                next_pos[i] = after
+                if after != -1:
+                    prev_pos[after] = i
+
+                # Add the pairs the merged token forms with its new neighbours
+                if before != -1:
+                    update_pair((token_ids[before], pair_id), before, freq)
+                if after != -1:
+                    update_pair((pair_id, token_ids[after]), i, freq)
+
+            del pair_counts[pair]
+            pair_positions.pop(pair, None)
+            changed_pairs.discard(pair)
+
+            for changed_pair in changed_pairs:
+                count = pair_counts[changed_pair]
+                if count > 0:
+                    heapq.heappush(heap, (-count, min(pair_positions[changed_pair]), changed_pair))
+                else:
+                    del pair_counts[changed_pair]
+                    del pair_positions[changed_pair]
+            changed_pairs.clear()
 
         # pass `test_train_adds_special_tokens`
         # handle special tokens
         if allowed_special:
             for special in allowed_special:
-                new_id = max(self.vocab) + 1
+                new_id = len(self.vocab)
                 self.vocab[new_id] = special
                 self.inverse_vocab[special] = new_id
 
@@ -150,13 +361,17 @@ class BPETokenizer:
         if len(token_ids) < 2:
             return None
 
-        # Count the pairs and return the most frequent one
-        pair_counter = Counter(zip(token_ids, token_ids[1:]))
-        max_pair = max(pair_counter, key=pair_counter.get)
-        if pair_counter[max_pair] > 1:
-            return max_pair
-        else:
+        # Count the pairs and return the most frequent one. Both steps run in C:
+        # `pairwise` yields the pairs without copying the list, and
+        # `most_common(1)` keeps the first pair among equally frequent ones.
+        pair_counter = Counter(pairwise(token_ids))
+        # If every pair is distinct none of them repeats, and we can skip
+        # looking for the maximum; otherwise the most common pair occurs twice
+        # or more
+        if len(pair_counter) == len(token_ids) - 1:
             return None
+        max_pair, _ = pair_counter.most_common(1)[0]
+        return max_pair
 
     @staticmethod
     def replace_pair(
@@ -179,22 +394,28 @@ class BPETokenizer:
             new_id = 4
             Returns: [4, 3, 4]  # Both occurrences of (1,2) became 4
         """
-        new_token_ids = []
-        token_ids_processing = deque(token_ids)
-
-        # Iterate through the token_ids using a deque for efficient popping from the left
-        while len(token_ids_processing) > 0:
-            left_id = token_ids_processing.popleft()
+        # Two-pointer scan over a copy of the input: `read` walks the tokens,
+        # `write` is where the next output token goes. The output is never
+        # longer than the input, so it is written in place and truncated.
+        new_token_ids = list(token_ids)
+        first, second = pair_to_replace
+        last = len(new_token_ids) - 1
+        read = write = 0
+        while read <= last:
             # Check if the next token forms the target pair with the current token
             if (
-                len(token_ids_processing) > 0
-                and (left_id, token_ids_processing[0]) == pair_to_replace
+                read < last
+                and new_token_ids[read] == first
+                and new_token_ids[read + 1] == second
             ):
-                # If so, append the new_id (merged token) and skip the next token
-                new_token_ids.append(new_id)
-                token_ids_processing.popleft()
+                # If so, write the new_id (merged token) and skip the next token
+                new_token_ids[write] = new_id
+                read += 2
             else:
-                # Otherwise, just append the current token
-                new_token_ids.append(left_id)
+                # Otherwise, just keep the current token
+                new_token_ids[write] = new_token_ids[read]
+                read += 1
+            write += 1
 
+        del new_token_ids[write:]
         return new_token_ids
@@ -1,4 +1,85 @@
-from collections import Counter, deque
+import functools
+import heapq
+import multiprocessing
+import re
+from collections import Counter, OrderedDict, defaultdict
+from itertools import pairwise
+
+# Pre-tokenization pattern, adapted from GPT-4's to the standard `re` module:
+# contractions, words with an optional leading space or punctuation, numbers
+# of up to three digits, punctuation runs and whitespace.
+_PRETOKENIZE_RE = re.compile(
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)"
+    r"|(?:[^\r\n\w]|_)?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?(?:[^\s\w]|_)+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+(?!\S)"
+    r"|\s+"
+)
+
+
+def _count_chunks(text: str) -> Counter:
+    """Pre-tokenize the text and count how often each chunk occurs."""
+    return Counter(_PRETOKENIZE_RE.findall(text))
+
+
+def _split_into_shards(text: str, num_shards: int) -> list[str]:
+    """
+    Split the text into roughly equal shards at paragraph breaks ("\n\n").
+
+    Each cut is placed right after the last newline of a whitespace run, where
+    `_PRETOKENIZE_RE` always ends a chunk, so counting the shards separately
+    gives exactly the same chunks as counting the whole text.
+    """
+    shards = []
+    start = 0
+    for k in range(1, num_shards):
+        paragraph_break = text.find("\n\n", max(start, k * len(text) // num_shards))
+        if paragraph_break == -1:
+            break
+        end = paragraph_break + 2
+        while end < len(text) and text[end].isspace():
+            end += 1
+        if end == len(text):
+            break
+        cut = max(text.rfind("\n", paragraph_break, end), text.rfind("\r", paragraph_break, end)) + 1
+        shards.append(text[start:cut])
+        start = cut
+    shards.append(text[start:])
+    return shards
+
+
+@functools.lru_cache(maxsize=32)
+def _special_tokens_re(special_tokens: frozenset[str]) -> re.Pattern:
+    """
+    Compile a pattern that splits text on any of the given special tokens.
+
+    Longer tokens come first, so a special token that contains another one
+    is matched as a whole.
+    """
+    alternatives = sorted(special_tokens, key=len, reverse=True)
+    return re.compile("(" + "|".join(map(re.escape, alternatives)) + ")")
+
+
+# The tokenizer each worker process of `BPETokenizer.encode_batch` encodes with
+_worker_tokenizer = None
+
+
+def _init_encode_worker(tokenizer: "BPETokenizer") -> None:
+    """Keep the tokenizer in the worker, so it is only sent over once."""
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_in_worker(text: str, allowed_specials: set[str] | None) -> list[int]:
+    """Encode one text with the worker's tokenizer."""
+    return _worker_tokenizer.encode(text, allowed_specials)
+
+
+# Marks "no unknown token ID found" in `BPETokenizer.decode`; unlike None, it
+# can never be one of the IDs passed in
+_NOT_FOUND = object()
 
 
 class BPETokenizer:
@@ -12,8 +93,15 @@ class BPETokenizer:
         self.inverse_vocab = {}
         # Dictionary of BPE merges: {(token1, token2): merged_token_id}
         self.bpe_merges = {}
+        # Token IDs of recently encoded chunks, least recently used first:
+        # {" hello": (12, 7)}
+        self._encode_cache = OrderedDict()
+        # Maximum number of chunks kept in `_encode_cache`
+        self._encode_cache_size = 100_000
         
-    def encode(self, text: str, allowed_specials: set[str] = None) -> list[int]:
+    def encode(
+        self, text: str, allowed_specials: set[str] = None, verbose: bool = False
+    ) -> list[int]:
         """
         Encode text into a sequence of token IDs using the trained BPE merges.
         
@@ -29,6 +117,7 @@ class BPETokenizer:
                 but appears in the text, all characters will be treated as regular text.
                 For example, if "<|endoftext|>" is in allowed_specials and text, it will
                 be encoded as a single token.
+            verbose (bool, optional): Print the intermediate segments while encoding.
             
         Returns:
             list[int]: A sequence of token IDs representing the encoded text. For example,
@@ -52,54 +141,41 @@ class BPETokenizer:
         
         # Step 1: Handle special tokens if provided in allowed_specials
         if allowed_specials:
-            # Validate all special tokens exist in vocabulary
-            if not set(allowed_specials) <= set(self.inverse_vocab):
-                raise ValueError(f"Special tokens {set(allowed_specials) - set(self.inverse_vocab)} not found in vocabulary.")
+            # Validate all special tokens exist in vocabulary. Look them up in
+            # `inverse_vocab` directly rather than building a set of the vocabulary.
+            missing_specials = set(allowed_specials).difference(self.inverse_vocab)
+            if missing_specials:
+                raise ValueError(f"Special tokens {missing_specials} not found in vocabulary.")
             else:
-                # Initialize processing queue with (text_segment, token_id) pairs
-                # token_id is None for regular text, actual token_id for special tokens
-                splitted_text_token_mapping = deque([(text, None)])
-                special_encoded_split = []
-
-                # Process each segment, looking for special tokens
-                while len(splitted_text_token_mapping) > 0:
-                    for special in allowed_specials:
-                        left_text, pre_token = splitted_text_token_mapping.popleft()
-                        print(left_text, pre_token)
-                        
-                        # Only look for special tokens in unprocessed text segments
-                        if pre_token is None and special in left_text:
-                            # Split text on special token boundaries
-                            left_split = left_text.split(special)
-                            print(left_split)
-
-                            # Case 1: Text is exactly the special token
-                            if left_split == ['']:
-                                special_encoded_split.append((special, self.inverse_vocab[special]))
-                            # Case 2: Text contains special token and regular text
-                            else:
-                                for i, itext in enumerate(left_split):
-                                    # Handle regular text segments
-                                    if itext != '':
-                                        special_encoded_split.append((itext, None))
-                                    
-                                    # Insert special token between text segments
-                                    # Don't add after the last segment
-                                    if i < len(left_split) - 1:
-                                        special_encoded_split.append((special, self.inverse_vocab[special]))
-                        else:
-                            # Pass through already processed segments unchanged
-                            special_encoded_split.append((left_text, pre_token))
+                # Split the text on all special tokens in a single regex pass.
+                # The pattern is a capture group, so the special tokens are kept
+                # in `parts` at the odd indices, between the regular segments.
+                parts = _special_tokens_re(frozenset(allowed_specials)).split(text)
+                # Pair each segment with its token_id: None for regular text,
+                # the vocabulary ID for special tokens
+                special_encoded_split = [
+                    (part, self.inverse_vocab[part] if i % 2 else None)
+                    for i, part in enumerate(parts)
+                    if part
+                ]
+                if verbose:
+                    print(special_encoded_split)
         else:
             # No special tokens - treat entire input as regular text
             special_encoded_split = [(text, None)]
 
-        # Step 2: Validate all regular text characters are in vocabulary
-        special_free_characters = "".join([text for text, pre_token in special_encoded_split if pre_token is None])
-        print(special_free_characters)
-        if not set(list(special_free_characters)) <= set(list(self.inverse_vocab)):
-            print(set(list(special_free_characters)))
-            raise ValueError("Unknown characters in text.")
+        # Step 2: Validate all regular text characters are in vocabulary.
+        # Collect the distinct characters and look them up in `inverse_vocab`
+        # directly, rather than building a set of the whole vocabulary.
+        regular_chars = set()
+        for text, pre_token in special_encoded_split:
+            if pre_token is None:
+                regular_chars.update(text)
+        unknown_chars = regular_chars.difference(self.inverse_vocab)
+        if unknown_chars:
+            if verbose:
+                print(unknown_chars)
+            raise ValueError(f"Unknown characters in text: {unknown_chars}")
 
         # Step 3: Encode all segments
         results = []
@@ -108,11 +184,81 @@ class BPETokenizer:
                 # Special tokens map directly to their vocabulary ID
                 results.append(pre_token)
             else:
-                # Regular text needs BPE encoding
-                results.extend(self.apply_merges([self.inverse_vocab[t] for t in text]))
+                # Regular text needs BPE encoding. It is split into the same
+                # chunks as in `train`, and since words repeat a lot, each
+                # distinct chunk only goes through `apply_merges` once.
+                cache = self._encode_cache
+                for chunk in _PRETOKENIZE_RE.findall(text):
+                    chunk_ids = cache.get(chunk)
+                    if chunk_ids is not None:
+                        cache.move_to_end(chunk)
+                    else:
+                        chunk_ids = tuple(self.apply_merges([self.inverse_vocab[t] for t in chunk]))
+                        if self._encode_cache_size:
+                            cache[chunk] = chunk_ids
+                            if len(cache) > self._encode_cache_size:
+                                # Evict the least recently used chunk
+                                cache.popitem(last=False)
+                    results.extend(chunk_ids)
 
         return results
     
+    def encode_batch(
+        self,
+        texts: list[str],
+        allowed_specials: set[str] = None,
+        num_workers: int = 1,
+        chunk_size: int = 100,
+    ) -> list[list[int]]:
+        """
+        Encode several texts, optionally spread over worker processes.
+
+        Args:
+            texts (list[str]): The texts to encode.
+            allowed_specials (set[str], optional): Special tokens allowed in the texts,
+                as in `encode`.
+            num_workers (int, optional): Number of processes to encode with. Each worker
+                gets its own copy of the tokenizer, so this only pays off for many or
+                long texts.
+            chunk_size (int, optional): Number of texts sent to a worker at a time.
+
+        Returns:
+            list[list[int]]: The token IDs of each text, in the same order as `texts`.
+
+        Raises:
+            ValueError: For the same reasons as `encode`
+        """
+        if num_workers <= 1 or len(texts) <= 1:
+            return [self.encode(text, allowed_specials) for text in texts]
+
+        with multiprocessing.Pool(
+            min(num_workers, len(texts)), initializer=_init_encode_worker, initargs=(self,)
+        ) as pool:
+            return pool.starmap(
+                _encode_in_worker,
+                [(text, allowed_specials) for text in texts],
+                chunksize=chunk_size,
+            )
+
+    def set_merge_cache_size(self, size: int) -> None:
+        """
+        Set how many encoded chunks `encode` keeps in its cache.
+
+        The least recently used chunks are evicted first once the cache is
+        full. A size of 0 disables the cache.
+
+        Args:
+            size (int): Maximum number of cached chunks.
+
+        Raises:
+            ValueError: If size is negative
+        """
+        if size < 0:
+            raise ValueError(f"Cache size must be non-negative, got {size}.")
+        self._encode_cache_size = size
+        while len(self._encode_cache) > size:
+            self._encode_cache.popitem(last=False)
+
     def decode(self, token_ids: list[int]) -> str:
         """
         Decode a sequence of token IDs back into text.
@@ -126,10 +272,12 @@ class BPETokenizer:
         Raises:
             ValueError: If any token ID is not in the vocabulary
         """
-        if not set(token_ids) <= set(self.vocab):
-            raise ValueError(f"Unknown token id {set(token_ids)- set(self.vocab)}") 
+        # Stop at the first unknown ID; dict lookups avoid building any sets
+        unknown_id = next((id for id in token_ids if id not in self.vocab), _NOT_FOUND)
+        if unknown_id is not _NOT_FOUND:
+            raise ValueError(f"Unknown token id {unknown_id}")
 
-        text = "".join([self.vocab[id] for id in token_ids])
+        text = "".join(map(self.vocab.__getitem__, token_ids))
         return text
         
     def apply_merges(self, token_ids: list[int]) -> list[int]:
@@ -147,28 +295,64 @@ class BPETokenizer:
         2. Find any adjacent pairs that have a merge rule
         3. Apply the merge by replacing the pair with its merged token ID
         4. Repeat until no more merges are possible
+
+        Merges are applied in the order they were learned (smallest merged token
+        ID first), which is how `train` segmented its own text.
         """
-        encoded_ids = []
-        token_ids = deque(token_ids)
-        # Handle empty or single token case
-        if len(token_ids) <= 1:
-            return list(token_ids)
-
-        # Process tokens by looking for merges
-        while len(token_ids) >= 2:
-            left_id = token_ids.popleft()
-            if (left_id, token_ids[0]) in self.bpe_merges:
-                encoded_ids.append(self.bpe_merges[(left_id, token_ids[0])])
-                token_ids.popleft()
-            else:
-                encoded_ids.append(left_id)
-        
-        # Append any remaining token
-        encoded_ids.extend(token_ids)
-        return encoded_ids
+        # Positions form a doubly-linked list, so merging only relinks the
+        # neighbours. `len(encoded_ids)` marks the end and -1 a removed token.
+        encoded_ids = list(token_ids)
+        end = len(encoded_ids)
+        prev_pos = list(range(-1, end - 1))
+        next_pos = list(range(1, end + 1))
+
+        # Min-heap of (merged_id, position) for every mergeable adjacent pair.
+        # Merged IDs grow in the order the merges were learned, so popping the
+        # smallest applies merges in training order, leftmost first on ties.
+        # Bind the lookup once instead of resolving `self.bpe_merges.get` per pair
+        get_merged_id = self.bpe_merges.get
+        heap = []
+        for i, pair in enumerate(pairwise(encoded_ids)):
+            merged_id = get_merged_id(pair)
+            if merged_id is not None:
+                heap.append((merged_id, i))
+        heapq.heapify(heap)
+
+        while heap:
+            merged_id, i = heapq.heappop(heap)
+            j = next_pos[i]
+            # Skip entries whose pair was changed by an earlier merge
+            if j == end or get_merged_id((encoded_ids[i], encoded_ids[j])) != merged_id:
+                continue
+
+            # Write the merged token at i and unlink j
+            encoded_ids[i] = merged_id
+            encoded_ids[j] = -1
+            after = next_pos[j]
+            next_pos[i] = after
+            if after != end:
+                prev_pos[after] = i
+
+            # The merged token may now form new mergeable pairs with its neighbours
+            before = prev_pos[i]
+            if before != -1:
+                new_merged_id = get_merged_id((encoded_ids[before], merged_id))
+                if new_merged_id is not None:
+                    heapq.heappush(heap, (new_merged_id, before))
+            if after != end:
+                new_merged_id = get_merged_id((merged_id, encoded_ids[after]))
+                if new_merged_id is not None:
+                    heapq.heappush(heap, (new_merged_id, i))
+
+        return [token_id for token_id in encoded_ids if token_id != -1]
 
     def train(
-        self, text: str, vocab_size: int, allowed_special: set[str] = None
+        self,
+        text: str,
+        vocab_size: int,
+        allowed_special: set[str] = None,
+        num_workers: int = 1,
+        verbose: bool = False,
     ) -> None:
         """
         Train the BPE tokenizer on the provided text.
@@ -177,6 +361,10 @@ class BPETokenizer:
             text (str): The training text.
             vocab_size (int): The desired vocabulary size.
             allowed_special (set[str], optional): Special tokens to include in the vocabulary.
+            num_workers (int, optional): Number of processes used to pre-tokenize and
+                count the text. The text is split on paragraph breaks, so this only
+                helps for large texts. The merge loop itself always runs in this process.
+            verbose (bool, optional): Print each pair as it is merged.
 
         Implementation note:
         This implementation satisfies three test cases in the tutorial:
@@ -186,33 +374,141 @@ class BPETokenizer:
 
         See the test file and tutorial for detailed expectations of each component.
         """
+        # Encoded chunks cached by `encode` belong to the previous merges
+        self._encode_cache.clear()
+
+        # Split the text into word-like chunks first; merges never cross a
+        # chunk boundary, so each distinct chunk only needs to be stored once
+        # together with how often it occurs.
+        shards = _split_into_shards(text, num_workers) if num_workers > 1 else [text]
+        if len(shards) > 1:
+            with multiprocessing.Pool(min(num_workers, len(shards))) as pool:
+                chunk_counts = Counter()
+                for partial_counts in pool.map(_count_chunks, shards):
+                    chunk_counts.update(partial_counts)
+        else:
+            chunk_counts = _count_chunks(text)
+
         # build the initial vocab without BPE
         # pass `test_train_builds_initial_vocab`
-        unique_char = sorted(list(set(text)))
-        self.vocab = {i: ch for i, ch in enumerate(unique_char)}
+        # The distinct chunks contain every character of the text, and are
+        # much shorter in total than the text itself
+        unique_char = sorted(set().union(*chunk_counts))
+        self.vocab = dict(enumerate(unique_char))
         self.inverse_vocab = {ch: i for i, ch in self.vocab.items()}
+        # Merges from an earlier call refer to IDs of the old vocab
+        self.bpe_merges = {}
 
         # pass `test_train_learns_merges_and_respects_vocab_size`
         # iterate vocab and build merges using BPE
-        token_ids = [self.inverse_vocab[ch] for ch in text]
-        while len(self.vocab) < vocab_size:
-            pair = self.find_freq_pair(token_ids)
-            print(pair)
-            if pair is None:
-                break
+        # Lay the distinct chunks out one after another as doubly-linked lists
+        # over positions, so a merge only touches the neighbours of each merged
+        # position instead of rebuilding the whole sequence. -1 means "no
+        # neighbour", which also separates the chunks.
+        token_ids, freqs, prev_pos, next_pos = [], [], [], []
+        for chunk, freq in chunk_counts.items():
+            start, end = len(token_ids), len(token_ids) + len(chunk)
+            token_ids.extend(self.inverse_vocab[ch] for ch in chunk)
+            freqs.extend([freq] * len(chunk))
+            prev_pos.extend(range(start - 1, end - 1))
+            next_pos.extend(range(start + 1, end + 1))
+            prev_pos[start] = -1
+            next_pos[-1] = -1
+
+        # Count every adjacent pair once (weighted by the chunk frequency),
+        # and remember where each pair occurs
+        pair_counts = Counter()
+        pair_positions = defaultdict(set)
+        for i, j in enumerate(next_pos):
+            if j != -1:
+                pair = (token_ids[i], token_ids[j])
+                pair_counts[pair] += freqs[i]
+                pair_positions[pair].add(i)
+
+        # Max-heap of (-count, first_position, pair). Counts and positions change
+        # as we merge, so instead of updating entries in place we push a new one
+        # and skip the stale ones (whose count or first position no longer match)
+        # when popped. Like `find_freq_pair`, ties go to the pair whose current
+        # first occurrence comes earliest.
+        heap = [(-count, min(pair_positions[pair]), pair) for pair, count in pair_counts.items()]
+        heapq.heapify(heap)
+
+        # Pairs whose count changed during the current merge. They are pushed
+        # once with their final count after the merge, rather than once per
+        # update, which keeps the number of stale heap entries down.
+        changed_pairs = set()
+
+        def update_pair(pair, position, delta):
+            pair_counts[pair] += delta
+            if delta > 0:
+                pair_positions[pair].add(position)
             else:
-                pair_id = max(self.vocab) + 1
-                self.bpe_merges[pair] = pair_id
+                pair_positions[pair].discard(position)
+            changed_pairs.add(pair)
+
+        # Same stopping rule as `find_freq_pair`: only merge repeated pairs.
+        # Every live count has an entry in the heap, so once the top entry is
+        # below 2 no pair can be merged anymore and we can stop right away.
+        while len(self.vocab) < vocab_size and heap and -heap[0][0] >= 2:
+            neg_count, first, pair = heapq.heappop(heap)
+            if pair_counts[pair] != -neg_count or min(pair_positions[pair]) != first:
+                continue
+            if verbose:
+                print(pair)
+
+            # IDs are dense (0 .. len(vocab) - 1), so the next free one is the size
+            pair_id = len(self.vocab)
+            self.bpe_merges[pair] = pair_id
+
+            self.vocab[pair_id] = self.vocab[pair[0]] + self.vocab[pair[1]]
+            self.inverse_vocab[self.vocab[pair_id]] = pair_id
 
-                self.vocab[pair_id] = self.vocab[pair[0]] + self.vocab[pair[1]]
-                self.inverse_vocab[self.vocab[pair_id]] = pair_id
-                token_ids = self.replace_pair(token_ids, pair, pair_id)
+            # Merge left to right, like `replace_pair` does
+            for i in sorted(pair_positions.pop(pair)):
+                j = next_pos[i]
+                # Skip positions already consumed by an overlapping merge (e.g. "aaa")
+                if token_ids[i] != pair[0] or j == -1 or token_ids[j] != pair[1]:
+                    continue
+                before, after = prev_pos[i], next_pos[j]
+                freq = freqs[i]
+
+                # Remove the pairs the merged tokens formed with their neighbours
+                if before != -1:
+                    update_pair((token_ids[before], pair[0]), before, -freq)
+                if after != -1:
+                    update_pair((pair[1], token_ids[after]), j, -freq)
+
+                # Splice out the right token and write the merged one in place
+                token_ids[i] = pair_id
+                token_ids[j] = -1
+                next_pos[i] = after
+                if after != -1:
+                    prev_pos[after] = i
+
+                # Add the pairs the merged token forms with its new neighbours
+                if before != -1:
+                    update_pair((token_ids[before], pair_id), before, freq)
+                if after != -1:
+                    update_pair((pair_id, token_ids[after]), i, freq)
+
+            del pair_counts[pair]
+            pair_positions.pop(pair, None)
+            changed_pairs.discard(pair)
+
+            for changed_pair in changed_pairs:
+                count = pair_counts[changed_pair]
+                if count > 0:
+                    heapq.heappush(heap, (-count, min(pair_positions[changed_pair]), changed_pair))
+                else:
+                    del pair_counts[changed_pair]
+                    del pair_positions[changed_pair]
+            changed_pairs.clear()
 
         # pass `test_train_adds_special_tokens`
         # handle special tokens
         if allowed_special:
             for special in allowed_special:
-                new_id = max(self.vocab) + 1
+                new_id = len(self.vocab)
                 self.vocab[new_id] = special
                 self.inverse_vocab[special] = new_id
 
@@ -238,13 +534,17 @@ class BPETokenizer:
         if len(token_ids) < 2:
             return None
 
-        # Count the pairs and return the most frequent one
-        pair_counter = Counter(zip(token_ids, token_ids[1:]))
-        max_pair = max(pair_counter, key=pair_counter.get)
-        if pair_counter[max_pair] > 1:
-            return max_pair
-        else:
+        # Count the pairs and return the most frequent one. Both steps run in C:
+        # `pairwise` yields the pairs without copying the list, and
+        # `most_common(1)` keeps the first pair among equally frequent ones.
+        pair_counter = Counter(pairwise(token_ids))
+        # If every pair is distinct none of them repeats, and we can skip
+        # looking for the maximum; otherwise the most common pair occurs twice
+        # or more
+        if len(pair_counter) == len(token_ids) - 1:
             return None
+        max_pair, _ = pair_counter.most_common(1)[0]
+        return max_pair
 
     @staticmethod
     def replace_pair(
@@ -267,22 +567,28 @@ class BPETokenizer:
             new_id = 4
             Returns: [4, 3, 4]  # Both occurrences of (1,2) became 4
         """
-        new_token_ids = []
-        token_ids_processing = deque(token_ids)
-
-        # Iterate through the token_ids using a deque for efficient popping from the left
-        while len(token_ids_processing) > 0:
-            left_id = token_ids_processing.popleft()
+        # Two-pointer scan over a copy of the input: `read` walks the tokens,
+        # `write` is where the next output token goes. The output is never
+        # longer than the input, so it is written in place and truncated.
+        new_token_ids = list(token_ids)
+        first, second = pair_to_replace
+        last = len(new_token_ids) - 1
+        read = write = 0
+        while read <= last:
             # Check if the next token forms the target pair with the current token
             if (
-                len(token_ids_processing) > 0
-                and (left_id, token_ids_processing[0]) == pair_to_replace
+                read < last
+                and new_token_ids[read] == first
+                and new_token_ids[read + 1] == second
             ):
-                # If so, append the new_id (merged token) and skip the next token
-                new_token_ids.append(new_id)
-                token_ids_processing.popleft()
+                # If so, write the new_id (merged token) and skip the next token
+                new_token_ids[write] = new_id
+                read += 2
             else:
-                # Otherwise, just append the current token
-                new_token_ids.append(left_id)
+                # Otherwise, just keep the current token
+                new_token_ids[write] = new_token_ids[read]
+                read += 1
+            write += 1
 
+        del new_token_ids[write:]
         return new_token_ids
@@ -25,7 +25,7 @@ class TestBPETokenizer:
         text = "hello"
         tokenizer.train(text, vocab_size=10)  # vocab_size is larger than unique chars
 
-        unique_chars = sorted(list(set(text)))
+        unique_chars = sorted(set(text))
         expected_vocab = {i: ch for i, ch in enumerate(unique_chars)}
         expected_inverse_vocab = {ch: i for i, ch in enumerate(unique_chars)}
 
@@ -40,7 +40,7 @@ class TestBPETokenizer:
         tokenizer = BPETokenizer()
         text = "ababab"  # Most frequent pair is ('a', 'b')
 
-        initial_chars = sorted(list(set(text)))
+        initial_chars = sorted(set(text))
         vocab_size = len(initial_chars) + 1  # Allows for exactly one merge
 
         tokenizer.train(text, vocab_size)
@@ -73,7 +73,7 @@ class TestBPETokenizer:
         tokenizer = BPETokenizer()
         text = "abcde"
 
-        initial_chars = sorted(list(set(text)))
+        initial_chars = sorted(set(text))
         vocab_size = len(initial_chars) + 5  # Plenty of room, but no pairs to merge
 
         tokenizer.train(text, vocab_size)
@@ -187,6 +187,48 @@ class TestBPETokenizer:
                 token in tokenizer.inverse_vocab
             ), f"Special token {token} should be in vocab"
 
+    def test_train_matches_find_freq_pair_loop(self):
+        """Test that train merges the same pairs, in the same order, as repeatedly
+        calling find_freq_pair and replace_pair, including on tied counts."""
+        tokenizer = BPETokenizer()
+        text = "ccccacaca"  # A single word with several tied pairs
+        vocab_size = 8
+        tokenizer.train(text, vocab_size)
+
+        token_ids = [tokenizer.inverse_vocab[ch] for ch in text]
+        expected_merges = {}
+        next_id = len(set(text))
+        while next_id < vocab_size:
+            pair = tokenizer.find_freq_pair(token_ids)
+            if pair is None:
+                break
+            expected_merges[pair] = next_id
+            token_ids = tokenizer.replace_pair(token_ids, pair, next_id)
+            next_id += 1
+
+        assert tokenizer.bpe_merges == expected_merges, "Ties should go to the pair that occurs first"
+
+    def test_train_does_not_merge_across_words(self):
+        """Test that merges stay within pre-tokenized, word-like chunks."""
+        tokenizer = BPETokenizer()
+        text = "a a a a"  # Chunks: "a", " a", " a", " a"
+        tokenizer.train(text, vocab_size=5)
+
+        assert " a" in tokenizer.inverse_vocab, "Space should merge with the following word"
+        assert "a " not in tokenizer.inverse_vocab, "Merges should not cross word boundaries"
+
+    def test_train_with_multiple_workers(self):
+        """Test that counting the text in several processes learns the same merges."""
+        text = "hello world\n\nhello there\n\nworld peace\n\n" * 10
+
+        tokenizer = BPETokenizer()
+        tokenizer.train(text, vocab_size=20)
+        parallel_tokenizer = BPETokenizer()
+        parallel_tokenizer.train(text, vocab_size=20, num_workers=2)
+
+        assert parallel_tokenizer.vocab == tokenizer.vocab
+        assert parallel_tokenizer.bpe_merges == tokenizer.bpe_merges
+
     def test_encode_basic(self):
         """Test encoding a simple string with learned tokens."""
         tokenizer = BPETokenizer()
@@ -211,6 +253,49 @@ class TestBPETokenizer:
         token_ids = tokenizer.encode(text)
         assert len(token_ids) < len(text), "Encoding should be shorter than original text"
 
+    def test_encode_after_retraining(self):
+        """Test that encoding uses only the merges of the latest training run."""
+        tokenizer = BPETokenizer()
+        tokenizer.train("abab", vocab_size=10)  # Learns the merge "ab"
+        assert len(tokenizer.encode("ab")) == 1
+
+        tokenizer.train("ab", vocab_size=10)  # No pair repeats, so no merges
+        assert tokenizer.bpe_merges == {}, "Merges of the previous run should be dropped"
+        token_ids = tokenizer.encode("ab")
+        assert token_ids == [tokenizer.inverse_vocab["a"], tokenizer.inverse_vocab["b"]]
+        assert tokenizer.decode(token_ids) == "ab"
+
+        tokenizer.train("hello hello", vocab_size=7)  # Learns new merges
+        token_ids = tokenizer.encode("hello")
+        assert len(token_ids) < 5, "Encoding should use the newly learned merges"
+        assert tokenizer.decode(token_ids) == "hello"
+
+    def test_encode_with_small_merge_cache(self):
+        """Test that the size of the merge cache does not change the encoding."""
+        tokenizer = BPETokenizer()
+        text = "the cat and the hat and the bat"
+        tokenizer.train(text, vocab_size=20)
+        expected = tokenizer.encode(text)
+
+        for size in (0, 1, 2):
+            tokenizer.set_merge_cache_size(size)
+            assert tokenizer.encode(text) == expected, f"Encoding changed with cache size {size}"
+
+        with pytest.raises(ValueError):
+            tokenizer.set_merge_cache_size(-1)
+
+    def test_encode_batch_with_multiple_workers(self):
+        """Test that encoding a batch in several processes matches encode."""
+        tokenizer = BPETokenizer()
+        tokenizer.train("hello world<|endoftext|>", vocab_size=15, allowed_special={"<|endoftext|>"})
+        texts = ["hello", "world hello", "", "hello<|endoftext|>world"] * 3
+        expected = [tokenizer.encode(text, allowed_specials={"<|endoftext|>"}) for text in texts]
+
+        for num_workers in (1, 2):
+            assert tokenizer.encode_batch(
+                texts, allowed_specials={"<|endoftext|>"}, num_workers=num_workers, chunk_size=2
+            ) == expected
+
     def test_encode_empty_string(self):
         """Test encoding an empty string."""
         tokenizer = BPETokenizer()
@@ -239,6 +324,9 @@ class TestBPETokenizer:
         with pytest.raises(ValueError):
             tokenizer.decode([999])  # Token ID 999 doesn't exist
 
+        with pytest.raises(ValueError):
+            tokenizer.decode([0, None])  # None is not a token ID
+
     def test_encode_with_special_tokens(self):
         """Test encoding with special tokens in the vocabulary."""
         tokenizer = BPETokenizer()
@@ -269,6 +357,22 @@ class TestBPETokenizer:
         expected_ids.append(tokenizer.inverse_vocab[special_token])
         assert token_ids == expected_ids
 
+    def test_encode_with_multiple_special_tokens(self):
+        """Test encoding text that contains several different special tokens."""
+        tokenizer = BPETokenizer()
+        special_tokens = {"<|endoftext|>", "<|pad|>"}
+        tokenizer.train("hello", vocab_size=10, allowed_special=special_tokens)
+
+        text = "he<|pad|>llo<|endoftext|><|pad|>"
+        token_ids = tokenizer.encode(text, allowed_specials=special_tokens)
+
+        expected_ids = [tokenizer.inverse_vocab[c] for c in "he"]
+        expected_ids.append(tokenizer.inverse_vocab["<|pad|>"])
+        expected_ids.extend(tokenizer.inverse_vocab[c] for c in "llo")
+        expected_ids.append(tokenizer.inverse_vocab["<|endoftext|>"])
+        expected_ids.append(tokenizer.inverse_vocab["<|pad|>"])
+        assert token_ids == expected_ids
+
     def test_decode_with_special_tokens(self):
         """Test decoding sequences containing special tokens."""
         tokenizer = BPETokenizer()
@@ -334,6 +438,31 @@ class TestBPETokenizer:
         decoded = tokenizer.decode(merged_ids)
         assert decoded == "hello", "Multiple merges should preserve original text"
 
+    def test_apply_merges_chained_rules(self):
+        """Test that a merge which only becomes possible after another merge is applied."""
+        tokenizer = BPETokenizer()
+        text = "abcabc"
+        tokenizer.train(text, vocab_size=5)  # Learns 'ab', then 'abc'
+
+        char_ids = [tokenizer.inverse_vocab[c] for c in "abc"]
+        merged_ids = tokenizer.apply_merges(char_ids)
+
+        assert merged_ids == [tokenizer.inverse_vocab["abc"]], "Should merge 'ab' and then 'abc'"
+
+    def test_apply_merges_matches_replace_pair_loop(self):
+        """Test that apply_merges gives the same result as calling replace_pair
+        once for every merge, in the order the merges were learned."""
+        tokenizer = BPETokenizer()
+        tokenizer.train("bcbcbc abab", vocab_size=10)  # Learns 'bc' before 'ab'
+
+        for text in ["abc", "abcbc", "aabcb", "bcbcabab"]:
+            token_ids = [tokenizer.inverse_vocab[c] for c in text]
+            expected = token_ids
+            for pair, new_id in sorted(tokenizer.bpe_merges.items(), key=lambda item: item[1]):
+                expected = tokenizer.replace_pair(expected, pair, new_id)
+
+            assert tokenizer.apply_merges(token_ids) == expected, f"Merges applied out of order for {text!r}"
+
     def test_apply_merges_empty_sequence(self):
         """Test applying merges to empty sequence."""
         tokenizer = BPETokenizer()